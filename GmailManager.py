@@ -1,12 +1,247 @@
 import smtplib, email
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import email.parser
+import email.policy
+import email.header
+import email.utils
+from email.message import EmailMessage, MIMEPart
 import imaplib
+import re
+import base64
+import io
 import os
+import time
+import urllib.parse
+import asyncio
+import datetime
+import itertools
+import weakref
+from collections import OrderedDict, deque
 import argparse
 
+# Read once at import time; Email() refuses to start without it.
+_EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+
+# Seconds an IMAP connection may sit idle before it is replaced on next use.
+_IMAP_IDLE_TIMEOUT = 300
+# Seconds an SMTP connection may sit idle before it is probed with NOOP.
+_SMTP_PROBE_AFTER = 60
+# Maximum number of UIDs sent in a single IMAP command, to stay well under
+# server line-length limits.
+_UID_BATCH_SIZE = 500
+# Attachments are base64-encoded in chunks of this many bytes. 57 input bytes
+# make one 76-character base64 line, so every chunk ends on a line boundary.
+_ATTACHMENT_CHUNK_SIZE = 57 * 1024
+# FETCH items for full messages and for header-only lookups. BODY.PEEK leaves
+# the \Seen flag untouched.
+_FETCH_FULL = "(RFC822)"
+_FETCH_HEADERS = "(BODY.PEEK[HEADER.FIELDS (SUBJECT FROM TO DATE MESSAGE-ID CONTENT-TYPE)])"
+# Maximum total size of the raw emails kept in each Email object's cache.
+_EMAIL_CACHE_BYTES = 16 * 1024 * 1024
+# Emails larger than this (typically ones with attachments) are never cached.
+_EMAIL_CACHE_MAX_ENTRY = 256 * 1024
+_UID_RE = re.compile(rb"\bUID (\d+)")
+# Tokens of an IMAP response: parentheses, quoted strings, literal markers and atoms.
+_IMAP_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|(\{\d+\})\s*$|([^\s()"]+))')
+# The IMAP UID of every email returned by the get_emails_by_* methods.
+_EMAIL_UIDS = weakref.WeakKeyDictionary()
+# Outgoing emails use CRLF line endings and only 7-bit transfer encodings, so
+# non-ASCII bodies are sent as quoted-printable or base64 rather than 8bit,
+# which would need BODY=8BITMIME.
+_SEND_POLICY = email.policy.SMTP.clone(cte_type="7bit")
+# Shared parsers, built once rather than per message. The header parser stops at
+# the end of the header block.
+_PARSER = email.parser.BytesParser(policy=email.policy.default)
+_HEADER_PARSER = email.parser.BytesHeaderParser(policy=email.policy.default)
+
+def _imap_quote(text):
+    """
+    Quotes a string for use as an IMAP SEARCH argument.
+
+    Args:
+        text (str): The string to quote.
+
+    Returns:
+        str: The string wrapped in double quotes, with quotes and backslashes escaped.
+    """
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _imap_date(date):
+    """
+    Converts a date to the DD-Mon-YYYY form used by IMAP SEARCH.
+
+    Args:
+        date (str or datetime.date): A date object, an RFC 2822 date such as
+            "Mon, 25 Dec 2023 10:00:00 +0000", an ISO date such as "2023-12-25",
+            or a day such as "25 Dec 2023".
+
+    Returns:
+        str: The date formatted as e.g. "25-Dec-2023".
+    """
+    if isinstance(date, str):
+        try:
+            date = email.utils.parsedate_to_datetime(date)
+        except (TypeError, ValueError):
+            for fmt in ("%Y-%m-%d", "%d %b %Y", "%a, %d %b %Y", "%d-%b-%Y"):
+                try:
+                    date = datetime.datetime.strptime(date.strip(), fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"Unrecognised date: {date!r}")
+    # strftime's %b is locale dependent; IMAP requires the English month names.
+    month = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()[date.month - 1]
+    return f"{date.day:02d}-{month}-{date.year}"
+
+def _uid_sets(uids):
+    """
+    Splits UIDs into comma-separated sets small enough for one IMAP command.
+
+    Args:
+        uids (list): The UIDs, as bytes, str or int.
+
+    Returns:
+        list: The UID sets, as bytes.
+    """
+    uids = [uid if isinstance(uid, bytes) else str(uid).encode() for uid in uids]
+    return [
+        b",".join(uids[start:start + _UID_BATCH_SIZE])
+        for start in range(0, len(uids), _UID_BATCH_SIZE)
+    ]
+
+def _parse_fetch_response(data):
+    """
+    Pairs each message in a UID FETCH response with its UID.
+
+    Args:
+        data (list): The data returned by imaplib for a UID FETCH command.
+
+    Returns:
+        dict: The raw bytes of each message, keyed by UID.
+    """
+    messages = []
+    for item in data:
+        if isinstance(item, tuple):
+            match = _UID_RE.search(item[0])
+            messages.append([match.group(1) if match else None, item[1]])
+        elif item and messages and messages[-1][0] is None:
+            # Some servers send the UID after the message literal.
+            match = _UID_RE.search(item)
+            if match:
+                messages[-1][0] = match.group(1)
+    return {uid: raw_email for uid, raw_email in messages if uid is not None}
+
+def _parse_imap_response(data):
+    """
+    Parses an imaplib response into nested lists.
+
+    Args:
+        data (list): The data returned by imaplib. Items are bytes, or
+            (bytes, literal) tuples where a line ended in a {n} literal.
+
+    Returns:
+        list: The parsed values. Parenthesised lists become lists, NIL becomes
+            None, and strings and atoms become str.
+    """
+    stack = [[]]
+    for item in data:
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        for match in _IMAP_TOKEN_RE.finditer(text or b""):
+            opening, closing, quoted, marker, atom = match.groups()
+            if opening:
+                stack.append([])
+            elif closing:
+                value = stack.pop()
+                stack[-1].append(value)
+            elif quoted is not None:
+                stack[-1].append(re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", "replace"))
+            elif atom is not None:
+                stack[-1].append(None if atom.upper() == b"NIL" else atom.decode("ascii", "replace"))
+        if literal is not None:
+            stack[-1].append(literal.decode("utf-8", "replace"))
+    return stack[0]
+
+def _bodystructure_attachments(body, part=""):
+    """
+    Lists the parts of a parsed BODYSTRUCTURE that carry a filename.
+
+    Args:
+        body (list): A body structure, as parsed by _parse_imap_response.
+        part (str, optional): The IMAP part number of body; empty for the whole message.
+
+    Returns:
+        list: A dictionary per attachment with its filename, size, part number and MIME type.
+    """
+    if isinstance(body[0], list):
+        attachments = []
+        children = itertools.takewhile(lambda child: isinstance(child, list), body)
+        for index, child in enumerate(children, 1):
+            child_part = f"{part}.{index}" if part else str(index)
+            attachments.extend(_bodystructure_attachments(child, child_part))
+        return attachments
+    mime = f"{body[0]}/{body[1]}".lower()
+    params = dict(zip(*[iter(body[2] or [])] * 2))
+    # Text parts carry a line count, and message/rfc822 parts an envelope, body
+    # and line count, before the extension fields.
+    extension = 7 + (1 if mime.startswith("text/") else 3 if mime == "message/rfc822" else 0)
+    disposition = body[extension + 1] if len(body) > extension + 1 else None
+    disposition_params = dict(zip(*[iter(disposition[1] or [])] * 2)) if disposition else {}
+    filename = _find_param(disposition_params, "filename") or _find_param(params, "name")
+    if not filename:
+        return []
+    filename = str(email.header.make_header(email.header.decode_header(filename)))
+    return [{"filename": filename, "size": int(body[6]), "part": part or "1", "mime": mime}]
+
+def _find_param(params, name):
+    """
+    Looks up a MIME parameter by case-insensitive name.
+
+    RFC 2231 extended (name*) and continued (name*0, name*1*, ...) forms are
+    decoded, since servers pass them through BODYSTRUCTURE unchanged.
+
+    Args:
+        params (dict): The parameters of a BODYSTRUCTURE part.
+        name (str): The name of the parameter.
+
+    Returns:
+        str: The parameter value, or None if it is not present.
+    """
+    params = {key.lower(): value for key, value in params.items() if value is not None}
+    if name in params:
+        return params[name]
+    if name + "*" in params:
+        return _decode_rfc2231(params[name + "*"])
+    sections = []
+    for key, value in params.items():
+        match = re.fullmatch(re.escape(name) + r"\*(\d+)(\*?)", key)
+        if match:
+            sections.append((int(match.group(1)), bool(match.group(2)), value))
+    if not sections:
+        return None
+    sections.sort()
+    if not sections[0][1]:
+        return "".join(value for _, _, value in sections)
+    # Only extended sections are percent-encoded; quote the plain ones to match.
+    encoded = "".join(value if extended else urllib.parse.quote(value) for _, extended, value in sections)
+    return _decode_rfc2231(encoded)
+
+def _decode_rfc2231(value):
+    """
+    Decodes an RFC 2231 extended parameter value such as "utf-8''r%C3%A9sum%C3%A9.pdf".
+
+    Args:
+        value (str): The extended parameter value.
+
+    Returns:
+        str: The decoded value.
+    """
+    charset, _, text = email.utils.decode_rfc2231(value)
+    try:
+        return urllib.parse.unquote(text, encoding=charset or "ascii", errors="replace")
+    except LookupError:
+        # Unknown charset; fall back to the MIME default.
+        return urllib.parse.unquote(text, encoding="ascii", errors="replace")
+
 class Email:
     """
     A class for sending and retrieving emails.
@@ -19,205 +254,760 @@ class Email:
         Args:
             sender_email (str): The email address of the sender.
             smtp_server (str): The SMTP server to use for sending emails.
+
+        Raises:
+            RuntimeError: If the EMAIL_PASSWORD environment variable was not set.
         """
+        if not _EMAIL_PASSWORD:
+            raise RuntimeError("EMAIL_PASSWORD unset")
         self.sender_email = sender_email
-        self.sender_password = os.environ.get('EMAIL_PASSWORD')
+        self.sender_password = _EMAIL_PASSWORD
         self.smtp_server = smtp_server
+        self._imap = None
+        self._imap_key = None
+        self._imap_last_used = 0.0
+        self._smtp = None
+        self._smtp_last_used = 0.0
+        self._selected_mailbox = None
+        self._mailbox_key = None
+        self._email_cache = OrderedDict()
+        self._email_cache_bytes = 0
 
-    def send_email(self, recipient_emails, subject, body, attachment=None):
+    def _get_imap(self):
         """
-        Sends an email.
+        Returns a logged-in IMAP connection, reusing the cached one when possible.
+
+        The cached connection is replaced if the server or sender changed, if it
+        has been idle longer than the idle timeout, or if a NOOP probe fails.
+
+        Returns:
+            imaplib.IMAP4_SSL: A logged-in IMAP connection.
+        """
+        key = (self.smtp_server, self.sender_email)
+        now = time.monotonic()
+        if self._imap is not None:
+            if self._imap_key != key or now - self._imap_last_used > _IMAP_IDLE_TIMEOUT:
+                self._close_imap()
+            else:
+                try:
+                    self._imap.noop()
+                except (imaplib.IMAP4.abort, OSError):
+                    self._close_imap()
+        if self._imap is None:
+            server = imaplib.IMAP4_SSL(self.smtp_server)
+            try:
+                server.login(self.sender_email, self.sender_password)
+                # Servers often advertise more capabilities (e.g. UIDPLUS) once
+                # logged in; imaplib only records the pre-login list.
+                _, data = server.capability()
+                server.capabilities = tuple(data[-1].decode("ascii").upper().split())
+            except Exception:
+                server.shutdown()
+                raise
+            self._imap = server
+            self._imap_key = key
+            self._selected_mailbox = None
+        self._imap_last_used = now
+        return self._imap
+
+    def _close_imap(self):
+        """
+        Logs out of and discards the cached IMAP connection, if any.
+        """
+        server, self._imap, self._imap_key = self._imap, None, None
+        if server is None:
+            return
+        try:
+            server.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+
+    def _select(self, mailbox):
+        """
+        Selects a mailbox on the pooled IMAP connection.
+
+        SELECT is skipped if the mailbox is already selected on the current
+        connection; the server keeps reporting changes to it regardless. The
+        untagged responses imaplib has collected since (such as EXISTS and
+        EXPUNGE) are discarded instead, as SELECT would have done.
+
+        Args:
+            mailbox (str): The name of the mailbox to select.
+
+        Returns:
+            imaplib.IMAP4_SSL: The connection, with the mailbox selected.
+
+        Raises:
+            imaplib.IMAP4.error: If the server refuses to select the mailbox.
+        """
+        server = self._get_imap()
+        if self._selected_mailbox == mailbox:
+            # Nothing reads them, and they would otherwise pile up on the pooled connection.
+            server.untagged_responses.clear()
+            return server
+        typ, data = server.select(mailbox)
+        if typ != "OK":
+            # A failed SELECT leaves the connection with no mailbox selected.
+            self._selected_mailbox = None
+            raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+        self._selected_mailbox = mailbox
+        # UIDs are only stable while UIDVALIDITY is unchanged, so it is part of
+        # every cache key.
+        _, [uidvalidity] = server.response("UIDVALIDITY")
+        self._mailbox_key = (mailbox, uidvalidity)
+        return server
+
+    def _get_smtp(self):
+        """
+        Returns a logged-in SMTP connection, reusing the cached one when possible.
+
+        A connection that has been idle for a while is probed with NOOP first,
+        and replaced if the server has dropped it.
+
+        Returns:
+            smtplib.SMTP: A logged-in SMTP connection.
+        """
+        now = time.monotonic()
+        if self._smtp is not None and now - self._smtp_last_used > _SMTP_PROBE_AFTER:
+            try:
+                code, _ = self._smtp.noop()
+            except (smtplib.SMTPServerDisconnected, OSError):
+                code = None
+            if code != 250:
+                self._close_smtp()
+        if self._smtp is None:
+            server = smtplib.SMTP(self.smtp_server)
+            try:
+                # starttls() raises if the server does not offer it, so the
+                # password is never sent over an unencrypted connection.
+                server.starttls()
+                server.ehlo()
+                server.login(self.sender_email, self.sender_password)
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+        self._smtp_last_used = now
+        return self._smtp
+
+    def _close_smtp(self):
+        """
+        Quits and discards the cached SMTP connection, if any.
+        """
+        server, self._smtp = self._smtp, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def close(self):
+        """
+        Closes any connections held open by this object and clears its email cache.
+        """
+        self._close_imap()
+        self._close_smtp()
+        self._email_cache.clear()
+        self._email_cache_bytes = 0
+
+    def build_message_template(self, subject, body, attachment=None):
+        """
+        Builds an email without recipients, ready to be sent to many of them.
+
+        The body and attachment are encoded once here, so sending the same
+        email to several recipients with send_template does not redo the work.
 
         Args:
-            recipient_emails (list): A list of email addresses of the recipients.
             subject (str): The subject of the email.
             body (str): The body of the email.
             attachment (str, optional): The path to the attachment file (if any).
 
         Returns:
-            str: A message indicating the success or failure of the email sending process.
+            bytes: The encoded email, without a To header.
         """
-        message = MIMEMultipart()
+        message = EmailMessage(policy=_SEND_POLICY)
         message["From"] = self.sender_email
-        message["To"] = ", ".join(recipient_emails)
         message["Subject"] = subject
 
-        message.attach(MIMEText(body, "plain"))
+        message.set_content(body)
 
         if attachment:
+            # Encode the file chunk by chunk so it is never held in memory whole.
+            encoded = io.BytesIO()
             with open(attachment, "rb") as file:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(file.read())
-            encoders.encode_base64(part)
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename= {attachment.split('/')[-1]}",
-            )
+                for chunk in iter(lambda: file.read(_ATTACHMENT_CHUNK_SIZE), b""):
+                    encoded.write(base64.encodebytes(chunk))
+            part = MIMEPart(policy=_SEND_POLICY)
+            part["Content-Type"] = "application/octet-stream"
+            part["Content-Transfer-Encoding"] = "base64"
+            # Passing filename as a parameter lets the email package quote or
+            # RFC 2231-encode names with spaces or non-ASCII characters.
+            part.add_header("Content-Disposition", "attachment", filename=os.path.basename(attachment))
+            part.set_payload(encoded.getvalue().decode("ascii"))
+            message.make_mixed()
             message.attach(part)
 
+        return message.as_bytes()
+
+    def send_template(self, recipient_emails, template):
+        """
+        Sends an email built by build_message_template.
+
+        Args:
+            recipient_emails (list): A list of email addresses of the recipients.
+            template (bytes): The email returned by build_message_template.
+
+        Returns:
+            str: A message indicating the success or failure of the email sending process.
+        """
+        # Header order does not matter, so the To header can simply go first.
+        to_header = _SEND_POLICY.header_factory("To", ", ".join(recipient_emails))
+        raw_message = to_header.fold(policy=_SEND_POLICY).encode("ascii") + template
         try:
-            with smtplib.SMTP(self.smtp_server) as server:
-                server.login(self.sender_email, self.sender_password)
-                server.sendmail(self.sender_email, recipient_emails, message.as_string())
+            try:
+                self._get_smtp().sendmail(self.sender_email, recipient_emails, raw_message)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                # The cached connection went away; reconnect once and resend.
+                self._close_smtp()
+                self._get_smtp().sendmail(self.sender_email, recipient_emails, raw_message)
             return "Email sent successfully."
         except Exception as e:
             return f"Failed to send email. Error: {str(e)}"
 
+    def send_email(self, recipient_emails, subject, body, attachment=None):
+        """
+        Sends an email.
+
+        Args:
+            recipient_emails (list): A list of email addresses of the recipients.
+            subject (str): The subject of the email.
+            body (str): The body of the email.
+            attachment (str, optional): The path to the attachment file (if any).
+
+        Returns:
+            str: A message indicating the success or failure of the email sending process.
+        """
+        template = self.build_message_template(subject, body, attachment)
+        return self.send_template(recipient_emails, template)
 
-    def get_emails_by_subject(self, subject):
+    def _search_uids(self, server, criteria):
+        """
+        Runs a UID SEARCH on the selected mailbox.
+
+        Values are sent as quoted strings. imaplib can only send ASCII arguments,
+        so a non-ASCII value is sent as a UTF-8 literal with CHARSET UTF-8. If
+        there are several, one search is run per non-ASCII value and the results
+        are intersected.
+
+        Args:
+            server (imaplib.IMAP4_SSL): A connection with a mailbox selected.
+            criteria (list): (key, value) pairs such as ("SUBJECT", "Invoice"); the
+                value is None for keys that take no argument, such as "ALL".
+
+        Returns:
+            list: The matching UIDs as bytes, or None if the server rejected the search.
+        """
+        args = []
+        non_ascii = []
+        for key, value in criteria:
+            if value is None:
+                args.append(key)
+            elif value.isascii():
+                args += [key, _imap_quote(value)]
+            else:
+                non_ascii.append((key, value))
+        if not non_ascii:
+            typ, data = server.uid("SEARCH", *args)
+            return data[0].split() if typ == "OK" else None
+        uids = None
+        for key, value in non_ascii:
+            # imaplib sends the literal after all other arguments, so the key goes last.
+            server.literal = value.encode()
+            typ, data = server.uid("SEARCH", "CHARSET", "UTF-8", *args, key)
+            if typ != "OK":
+                return None
+            found = data[0].split()
+            if uids is None:
+                uids = found
+            else:
+                found = set(found)
+                uids = [uid for uid in uids if uid in found]
+            if not uids:
+                break
+        return uids
+
+    def _fetch_raw_emails(self, server, uids, headers_only=False):
+        """
+        Fetches messages by UID in batches rather than one FETCH per message.
+
+        Messages are yielded one batch at a time, so only a single batch is held
+        in memory however many UIDs are given.
+
+        Args:
+            server (imaplib.IMAP4_SSL): A connection with a mailbox selected.
+            uids (list): The UIDs of the messages to fetch, as bytes.
+            headers_only (bool, optional): Fetch only the common headers instead of the whole message.
+
+        Yields:
+            tuple: The UID and raw bytes of each fetched message.
+        """
+        items = _FETCH_HEADERS if headers_only else _FETCH_FULL
+        for uid_set in _uid_sets(uids):
+            _, data = server.uid("FETCH", uid_set, items)
+            yield from _parse_fetch_response(data).items()
+
+    def _fetch_emails(self, server, uids, headers_only=False):
+        """
+        Returns parsed messages by UID, in the order of uids.
+
+        Args:
+            server (imaplib.IMAP4_SSL): A connection with a mailbox selected.
+            uids (list): The UIDs of the messages to fetch, as bytes.
+            headers_only (bool, optional): Fetch and parse only the common headers.
+
+        Returns:
+            list: A list of email objects, in the order of uids.
+        """
+        emails = self._fetch_email_map(server, uids, headers_only)
+        return [emails[uid] for uid in uids if uid in emails]
+
+    def _fetch_email_map(self, server, uids, headers_only=False):
+        """
+        Returns parsed messages by UID, fetching only those not already cached.
+
+        The raw bytes of fetched messages are cached per (mailbox, UIDVALIDITY,
+        UID). A message's content never changes while its UID is valid, so
+        entries only need to be evicted when the cache is full. Every call
+        parses a new email object, so callers never share one.
+
+        Args:
+            server (imaplib.IMAP4_SSL): A connection with a mailbox selected.
+            uids (list): The UIDs of the messages to fetch, as bytes.
+            headers_only (bool, optional): Fetch and parse only the common headers.
+
+        Returns:
+            dict: The email objects that were found, keyed by UID.
+        """
+        emails = {}
+        missing = []
+        for uid in uids:
+            # A cached full message also satisfies a header-only lookup.
+            for key in ((*self._mailbox_key, uid, headers_only), (*self._mailbox_key, uid, False)):
+                if key in self._email_cache:
+                    self._email_cache.move_to_end(key)
+                    emails[uid] = self._parse_email(uid, self._email_cache[key], headers_only)
+                    break
+            else:
+                missing.append(uid)
+        for uid, raw_email in self._fetch_raw_emails(server, missing, headers_only):
+            self._cache_email(uid, headers_only, raw_email)
+            emails[uid] = self._parse_email(uid, raw_email, headers_only)
+        return emails
+
+    def _parse_email(self, uid, raw_email, headers_only):
+        """
+        Parses a fetched message and records its UID for get_email_uid.
+
+        Args:
+            uid (bytes): The UID of the message in the selected mailbox.
+            raw_email (bytes): The raw message, or just its headers.
+            headers_only (bool): Parse only the headers.
+
+        Returns:
+            email.message.EmailMessage: The parsed message.
+        """
+        parser = _HEADER_PARSER if headers_only else _PARSER
+        email_message = parser.parsebytes(raw_email)
+        _EMAIL_UIDS[email_message] = uid
+        return email_message
+
+    def _cache_email(self, uid, headers_only, raw_email):
+        """
+        Adds a raw message to the cache, evicting the least recently used ones.
+
+        Messages larger than _EMAIL_CACHE_MAX_ENTRY are not cached.
+
+        Args:
+            uid (bytes): The UID of the message in the selected mailbox.
+            headers_only (bool): Whether raw_email holds only the common headers.
+            raw_email (bytes): The raw message.
+        """
+        if len(raw_email) > _EMAIL_CACHE_MAX_ENTRY:
+            return
+        key = (*self._mailbox_key, uid, headers_only)
+        self._uncache_email(key)
+        self._email_cache[key] = raw_email
+        self._email_cache_bytes += len(raw_email)
+        while self._email_cache_bytes > _EMAIL_CACHE_BYTES:
+            _, evicted = self._email_cache.popitem(last=False)
+            self._email_cache_bytes -= len(evicted)
+
+    def _uncache_email(self, key):
+        """
+        Removes a message from the cache, if present.
+
+        Args:
+            key (tuple): The (mailbox, uidvalidity, uid, headers_only) cache key.
+        """
+        raw_email = self._email_cache.pop(key, None)
+        if raw_email is not None:
+            self._email_cache_bytes -= len(raw_email)
+
+    def get_emails_by_subject(self, subject, headers_only=False):
         """
         Retrieves emails by subject.
 
         Args:
             subject (str): The subject of the emails to retrieve.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
 
         Returns:
             list: A list of email objects matching the specified subject.
         """
-        emails = []
-        with imaplib.IMAP4_SSL(self.smtp_server) as server:
-            server.login(self.sender_email, self.sender_password)
-            server.select("inbox")
-            _, data = server.search(None, f'SUBJECT "{subject}"')
-            email_ids = data[0].split()
-            for email_id in email_ids:
-                _, email_data = server.fetch(email_id, "(RFC822)")
-                raw_email = email_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                emails.append(email_message)
-        return emails
+        server = self._select("inbox")
+        uids = self._search_uids(server, [("SUBJECT", subject)])
+        return self._fetch_emails(server, uids or [], headers_only)
 
-    def get_emails_by_body(self, body):
+    def get_emails_by_body(self, body, headers_only=False):
         """
         Retrieves emails by body.
 
         Args:
             body (str): The body of the emails to retrieve.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
 
         Returns:
             list: A list of email objects matching the specified body.
         """
-    
-        emails = []
-        with imaplib.IMAP4_SSL(self.smtp_server) as server:
-            server.login(self.sender_email, self.sender_password)
-            server.select("inbox")
-            _, data = server.search(None, "ALL")
-            email_ids = data[0].split()
-            for email_id in email_ids:
-                _, email_data = server.fetch(email_id, "(RFC822)")
-                raw_email = email_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                if body in email_message.get_payload():
-                    emails.append(email_message)
-        return emails
-        
+        return self.get_emails_matching_bodies([body], headers_only)[body]
+
+    def get_emails_matching_bodies(self, bodies, headers_only=False):
+        """
+        Retrieves emails matching any of several bodies, grouped by body.
+
+        Every matching email is fetched once, however many of the bodies it matches.
 
-    def get_emails_by_date(self, date):
+        Args:
+            bodies (list): The bodies of the emails to retrieve.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
+
+        Returns:
+            dict: A list of email objects for each body, keyed by body.
+        """
+        server = self._select("inbox")
+        matches = {}
+        for body in bodies:
+            uids = self._search_uids(server, [("BODY", body)])
+            if uids is None:
+                break
+            matches[body] = uids
+        else:
+            uids = list(dict.fromkeys(itertools.chain.from_iterable(matches.values())))
+            emails = self._fetch_email_map(server, uids, headers_only)
+            return {
+                body: [emails[uid] for uid in body_uids if uid in emails]
+                for body, body_uids in matches.items()
+            }
+        # The server refused the BODY search, so scan the mailbox locally, once
+        # for all bodies. The checks run on the raw bytes; only matching emails
+        # are parsed.
+        uids = self._search_uids(server, [("ALL", None)]) or []
+        needles = {body: body.encode() for body in bodies}
+        grouped = {body: [] for body in bodies}
+        for uid, raw_email in self._fetch_raw_emails(server, uids):
+            matched = [body for body, needle in needles.items() if needle in raw_email]
+            if matched:
+                self._cache_email(uid, False, raw_email)
+                email_message = self._parse_email(uid, raw_email, headers_only)
+                for body in matched:
+                    grouped[body].append(email_message)
+        return grouped
+
+    def get_emails_by_date(self, date, headers_only=False):
         """
         Retrieves emails by date.
 
+        The match is made by the server against each email's Date header.
+
         Args:
-            date (str): The date of the emails to retrieve.
+            date (str or datetime.date): The date of the emails to retrieve, in any
+                form accepted by _imap_date (e.g. "25 Dec 2023" or "2023-12-25").
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
 
         Returns:
             list: A list of email objects matching the specified date.
         """
-        emails = []
-        with imaplib.IMAP4_SSL(self.smtp_server) as server:
-            server.login(self.sender_email, self.sender_password)
-            server.select("inbox")
-            _, data = server.search(None, "ALL")
-            email_ids = data[0].split()
-            for email_id in email_ids:
-                _, email_data = server.fetch(email_id, "(RFC822)")
-                raw_email = email_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                if date in email_message["Date"]:
-                    emails.append(email_message)
-        return emails
+        server = self._select("inbox")
+        uids = self._search_uids(server, [("SENTON", _imap_date(date))])
+        return self._fetch_emails(server, uids or [], headers_only)
 
-    def get_emails_by_recipient(self, recipient):
+    def get_emails_by_recipient(self, recipient, headers_only=False):
         """
         Retrieves emails by recipient.
 
         Args:
             recipient (str): The recipient of the emails to retrieve.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
 
         Returns:
             list: A list of email objects matching the specified recipient.
         """
-        emails = []
-        with imaplib.IMAP4_SSL(self.smtp_server) as server:
-            server.login(self.sender_email, self.sender_password)
-            server.select("inbox")
-            _, data = server.search(None, f'TO "{recipient}"')
-            email_ids = data[0].split()
-            for email_id in email_ids:
-                _, email_data = server.fetch(email_id, "(RFC822)")
-                raw_email = email_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                emails.append(email_message)
-        return emails
+        server = self._select("inbox")
+        uids = self._search_uids(server, [("TO", recipient)])
+        return self._fetch_emails(server, uids or [], headers_only)
 
-    def get_emails_by_sender(self, sender):
+    def get_emails_by_sender(self, sender, headers_only=False):
         """
         Retrieves emails by sender.
 
         Args:
             sender (str): The sender of the emails to retrieve.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
 
         Returns:
             list: A list of email objects matching the specified sender.
         """
-        emails = []
-        with imaplib.IMAP4_SSL(self.smtp_server) as server:
-            server.login(self.sender_email, self.sender_password)
-            server.select("inbox")
-            _, data = server.search(None, f'FROM "{sender}"')
-            email_ids = data[0].split()
-            for email_id in email_ids:
-                _, email_data = server.fetch(email_id, "(RFC822)")
-                raw_email = email_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                emails.append(email_message)
-        return emails
+        server = self._select("inbox")
+        uids = self._search_uids(server, [("FROM", sender)])
+        return self._fetch_emails(server, uids or [], headers_only)
     
+    def search(self, *, subject=None, sender=None, recipient=None, since=None, before=None,
+               body=None, headers_only=False):
+        """
+        Retrieves emails matching all of the given criteria in a single IMAP search.
+
+        Args:
+            subject (str, optional): Text the subject must contain.
+            sender (str, optional): Text the From header must contain.
+            recipient (str, optional): Text the To header must contain.
+            since (str or datetime.date, optional): The earliest date (inclusive), by Date header.
+            before (str or datetime.date, optional): The date the emails must be sent before, by Date header.
+            body (str, optional): Text the body must contain.
+            headers_only (bool, optional): Fetch only the Subject, From, To, Date, Message-ID
+                and Content-Type headers instead of the whole email.
+
+        Returns:
+            list: A list of email objects matching every given criterion.
+        """
+        criteria = [
+            (key, value)
+            for key, value in (("SUBJECT", subject), ("FROM", sender), ("TO", recipient), ("BODY", body))
+            if value is not None
+        ]
+        if since is not None:
+            criteria.append(("SENTSINCE", _imap_date(since)))
+        if before is not None:
+            criteria.append(("SENTBEFORE", _imap_date(before)))
+        server = self._select("inbox")
+        uids = self._search_uids(server, criteria or [("ALL", None)])
+        return self._fetch_emails(server, uids or [], headers_only)
+
+    async def gather_emails(self, queries, max_connections=2):
+        """
+        Runs several get_emails_by_* queries concurrently.
+
+        Each query runs in a worker thread on its own IMAP connection. At most
+        max_connections connections are open at once, since providers limit
+        how many connections one account may hold. This object's own pooled
+        connection is one of them, so do not use it elsewhere while the
+        queries run.
+
+        Args:
+            queries (list): (method_name, *args) tuples, e.g.
+                [("get_emails_by_subject", "Test"), ("get_emails_by_sender", "a@b.com")].
+            max_connections (int, optional): The maximum number of IMAP connections to use.
+
+        Returns:
+            list: One list of email objects per query, in the order given.
+
+        Raises:
+            Exception: The first exception raised by a query, once every query
+                already running has finished. Queries not yet started are skipped.
+        """
+        if not queries:
+            return []
+        workers = asyncio.Queue()
+        workers.put_nowait(self)
+        extra_workers = []
+        for _ in range(min(max_connections, len(queries)) - 1):
+            worker = Email(self.sender_email, self.smtp_server)
+            worker.sender_password = self.sender_password
+            extra_workers.append(worker)
+            workers.put_nowait(worker)
+
+        stopped = False
+
+        async def run(method_name, *args):
+            nonlocal stopped
+            worker = await workers.get()
+            try:
+                if stopped:
+                    return None
+                return await asyncio.to_thread(getattr(worker, method_name), *args)
+            except BaseException:
+                # Set before the worker is handed on, so no queued query starts.
+                stopped = True
+                raise
+            finally:
+                workers.put_nowait(worker)
+
+        # The tasks are never cancelled: a cancelled task would return while its
+        # thread is still using a worker.
+        tasks = [asyncio.ensure_future(run(*query)) for query in queries]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            # On failure or cancellation, wait for the queries already running
+            # before closing the workers they use.
+            stopped = True
+            await asyncio.wait(tasks)
+            for worker in extra_workers:
+                worker.close()
+        return [task.result() for task in tasks]
+
+    def mark_read(self, uids):
+        """
+        Marks emails in the inbox as read, with one STORE per batch of UIDs.
+
+        Args:
+            uids (list): The IMAP UIDs of the emails (see get_email_uid).
+        """
+        server = self._select("inbox")
+        for uid_set in _uid_sets(uids):
+            server.uid("STORE", uid_set, "+FLAGS", r"(\Seen)")
+
+    def delete(self, uids):
+        """
+        Deletes emails from the inbox, with one STORE and one EXPUNGE per batch of UIDs.
+
+        Args:
+            uids (list): The IMAP UIDs of the emails (see get_email_uid).
+
+        Raises:
+            imaplib.IMAP4.error: If the server lacks the UIDPLUS extension. A plain
+                EXPUNGE would also remove other emails already flagged as deleted,
+                so nothing is changed.
+        """
+        server = self._select("inbox")
+        if "UIDPLUS" not in server.capabilities:
+            raise imaplib.IMAP4.error("server does not support UIDPLUS; cannot expunge only the given emails")
+        uid_sets = _uid_sets(uids)
+        for uid_set in uid_sets:
+            server.uid("STORE", uid_set, "+FLAGS", r"(\Deleted)")
+            server.uid("EXPUNGE", uid_set)
+        deleted = {uid for uid_set in uid_sets for uid in uid_set.split(b",")}
+        for key in [key for key in self._email_cache if key[:2] == self._mailbox_key and key[2] in deleted]:
+            self._uncache_email(key)
+
+    def get_attachment_manifest(self, uid):
+        """
+        Lists the attachments of an email without downloading them.
+
+        Only the email's BODYSTRUCTURE is fetched; use download_attachment to
+        fetch individual attachments.
+
+        Args:
+            uid (bytes or str): The IMAP UID of the email in the inbox (see get_email_uid).
+
+        Returns:
+            list: A dictionary per attachment with "filename", "size" (encoded, in bytes),
+                "part" (the IMAP part number) and "mime" (the content type).
+        """
+        server = self._select("inbox")
+        _, data = server.uid("FETCH", uid, "(BODYSTRUCTURE)")
+        for response in _parse_imap_response(data):
+            if not isinstance(response, list):
+                continue
+            fields = dict(zip(response[::2], response[1::2]))
+            if fields.get("BODYSTRUCTURE"):
+                return _bodystructure_attachments(fields["BODYSTRUCTURE"])
+        return []
+
+    def download_attachment(self, uid, part):
+        """
+        Downloads a single attachment of an email.
+
+        Args:
+            uid (bytes or str): The IMAP UID of the email in the inbox (see get_email_uid).
+            part (str): The IMAP part number of the attachment, as listed by get_attachment_manifest.
+
+        Returns:
+            bytes: The decoded content of the attachment.
+        """
+        server = self._select("inbox")
+        _, data = server.uid("FETCH", uid, f"(BODY.PEEK[{part}.MIME] BODY.PEEK[{part}])")
+        headers = content = b""
+        for item in data:
+            if isinstance(item, tuple):
+                if b".MIME]" in item[0].upper():
+                    headers = item[1]
+                else:
+                    content = item[1]
+        # Rejoin the part's MIME headers and content so its transfer encoding is undone.
+        return _PARSER.parsebytes(headers + content).get_payload(decode=True)
+
     def get_attachments(self, email):
         """
         Retrieves attachments from an email.
 
+        For multipart emails parsed with policy.default (as returned by the
+        get_emails_by_* methods), the body part is skipped via
+        EmailMessage.iter_attachments rather than walked. iter_attachments yields
+        nothing for single-part and multipart/alternative emails, so those are
+        walked whole. Only non-multipart parts with a Content-Disposition and a
+        filename are returned.
+
         Args:
             email (email.message.Message): The email from which to retrieve attachments.
 
         Returns:
             list: A list of attachment objects.
         """
+        if isinstance(email, EmailMessage) and email.is_multipart() and email.get_content_subtype() != "alternative":
+            pending = deque(email.iter_attachments())
+        else:
+            pending = deque([email])
         attachments = []
-        for part in email.walk():
-            if part.get_content_maintype() == "multipart":
+        while pending:
+            part = pending.popleft()
+            if part.is_multipart():
+                pending.extendleft(reversed(part.get_payload()))
                 continue
             if part.get("Content-Disposition") is None:
                 continue
-            file_name = part.get_filename()
-            if bool(file_name):
+            if part.get_filename():
                 attachments.append(part)
         return attachments
     
-    def get_email_body(self, email):
+    def get_email_body(self, email, decode=False):
         """
         Retrieves the body of an email.
 
         Args:
             email (email.message.Message): The email from which to retrieve the body.
+            decode (bool, optional): Decode the body to str using the charset of its part.
 
         Returns:
-            str: The body of the email.
+            bytes: The body of the email, with its transfer encoding undone; str if decode is True.
         """
-        if email.is_multipart():
-            return self.get_email_body(email.get_payload(0))
-        else:
-            return email.get_payload(None, True)
+        part = email
+        while part.is_multipart():
+            part = part.get_payload(0)
+        body = part.get_payload(decode=True)
+        if decode and body is not None:
+            try:
+                return body.decode(part.get_content_charset() or "ascii", "replace")
+            except LookupError:
+                # Unknown charset; fall back to the MIME default.
+                return body.decode("ascii", "replace")
+        return body
         
     def get_email_subject(self, email):
         """
@@ -279,6 +1069,18 @@ class Email:
         """
         return email["Message-ID"]
     
+    def get_email_uid(self, email):
+        """
+        Retrieves the IMAP UID of an email.
+
+        Args:
+            email (email.message.Message): An email returned by one of the get_emails_by_* methods.
+
+        Returns:
+            bytes: The UID of the email in the inbox, or None if it was not fetched over IMAP.
+        """
+        return _EMAIL_UIDS.get(email)
+
     def get_email_content_type(self, email):
         """
         Retrieves the content type of an email.
@@ -316,8 +1118,10 @@ class Email:
         return dict(email.items())
     
 
-if __name__ == "__main__":
-    
+async def main():
+    """
+    Sends a test email, then looks it up by subject and by recipient concurrently.
+    """
     parser = argparse.ArgumentParser() 
     parser.add_argument("--from_email", help="The email address of the sender.") 
     parser.add_argument("--to_email", help="The email address of the recipient.")
@@ -331,4 +1135,12 @@ if __name__ == "__main__":
     
     email = Email(from_email, "smtp.gmail.com")
     email.send_email([to_email], "Test", "This is a test email.", "test.txt")
-    emails = email.get_emails_by_subject("Test")
\ No newline at end of file
+    emails_by_subject, emails_by_recipient = await email.gather_emails([
+        ("get_emails_by_subject", "Test"),
+        ("get_emails_by_recipient", to_email),
+    ])
+    email.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
\ No newline at end of file
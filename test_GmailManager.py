@@ -0,0 +1,453 @@
+import asyncio
+import datetime
+import threading
+import time
+import unittest
+from unittest import mock
+
+import GmailManager
+
+
+class ImapDateTest(unittest.TestCase):
+    """
+    Tests for _imap_date.
+    """
+
+    def test_accepts_common_forms(self):
+        for value in (
+            "Mon, 25 Dec 2023 10:00:00 +0000",
+            "2023-12-25",
+            "25 Dec 2023",
+            "Mon, 25 Dec 2023",
+            "25-Dec-2023",
+            datetime.date(2023, 12, 25),
+            datetime.datetime(2023, 12, 25, 23, 59),
+        ):
+            self.assertEqual(GmailManager._imap_date(value), "25-Dec-2023")
+
+    def test_pads_day(self):
+        self.assertEqual(GmailManager._imap_date("2024-01-05"), "05-Jan-2024")
+
+    def test_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            GmailManager._imap_date("Christmas")
+
+
+class ParseImapResponseTest(unittest.TestCase):
+    """
+    Tests for _parse_imap_response.
+    """
+
+    def test_nested_lists_nil_and_atoms(self):
+        data = [b'1 (UID 5 FLAGS (\\Seen) X NIL)']
+        self.assertEqual(
+            GmailManager._parse_imap_response(data),
+            ["1", ["UID", "5", "FLAGS", ["\\Seen"], "X", None]],
+        )
+
+    def test_quoted_strings_are_unescaped(self):
+        data = [b'("a \\"b\\" \\\\c" "" "caf\xc3\xa9")']
+        self.assertEqual(GmailManager._parse_imap_response(data), [['a "b" \\c', "", "café"]])
+
+    def test_literals(self):
+        data = [(b'1 (UID 5 BODYSTRUCTURE ("filename" {9}', b'a "b".pdf'), b'))']
+        self.assertEqual(
+            GmailManager._parse_imap_response(data),
+            ["1", ["UID", "5", "BODYSTRUCTURE", ["filename", 'a "b".pdf']]],
+        )
+
+
+class ParseFetchResponseTest(unittest.TestCase):
+    """
+    Tests for _parse_fetch_response.
+    """
+
+    def test_uid_before_literal(self):
+        data = [(b"1 (UID 101 RFC822 {3}", b"abc"), b")", (b"2 (UID 102 RFC822 {3}", b"def"), b")"]
+        self.assertEqual(GmailManager._parse_fetch_response(data), {b"101": b"abc", b"102": b"def"})
+
+    def test_uid_after_literal(self):
+        data = [(b"1 (RFC822 {3}", b"abc"), b" UID 101)"]
+        self.assertEqual(GmailManager._parse_fetch_response(data), {b"101": b"abc"})
+
+    def test_message_without_uid_is_dropped(self):
+        data = [(b"1 (RFC822 {3}", b"abc"), b")"]
+        self.assertEqual(GmailManager._parse_fetch_response(data), {})
+
+
+class BodystructureAttachmentsTest(unittest.TestCase):
+    """
+    Tests for _bodystructure_attachments.
+    """
+
+    def parse(self, bodystructure):
+        return GmailManager._parse_imap_response([bodystructure])[0]
+
+    def test_multipart_part_numbers(self):
+        body = self.parse(
+            b'((("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 3 1 NIL NIL NIL NIL)'
+            b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 10 1 NIL NIL NIL NIL) "alternative")'
+            b'("application" "pdf" ("name" "a.pdf") NIL NIL "base64" 1234 NIL ("attachment" ("filename" "a.pdf")) NIL NIL)'
+            b'("text" "plain" NIL NIL NIL "7bit" 20 2 NIL ("attachment" ("filename" "notes.txt")) NIL NIL)'
+            b' "mixed" ("boundary" "xyz") NIL NIL NIL)'
+        )
+        self.assertEqual(GmailManager._bodystructure_attachments(body), [
+            {"filename": "a.pdf", "size": 1234, "part": "2", "mime": "application/pdf"},
+            {"filename": "notes.txt", "size": 20, "part": "3", "mime": "text/plain"},
+        ])
+
+    def test_single_part_message(self):
+        body = self.parse(b'("application" "pdf" ("name" "x.pdf") NIL NIL "base64" 10)')
+        self.assertEqual(GmailManager._bodystructure_attachments(body), [
+            {"filename": "x.pdf", "size": 10, "part": "1", "mime": "application/pdf"},
+        ])
+
+    def test_parts_without_filename_are_skipped(self):
+        body = self.parse(b'("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 3 1 NIL NIL NIL NIL)')
+        self.assertEqual(GmailManager._bodystructure_attachments(body), [])
+
+    def test_encoded_word_filename(self):
+        body = self.parse(
+            b'("application" "pdf" NIL NIL NIL "base64" 10 NIL'
+            b' ("attachment" ("filename" "=?utf-8?q?r=C3=A9sum=C3=A9.pdf?=")) NIL NIL)'
+        )
+        self.assertEqual(GmailManager._bodystructure_attachments(body)[0]["filename"], "résumé.pdf")
+
+    def test_rfc2231_filename(self):
+        body = self.parse(
+            b'("application" "octet-stream" NIL NIL NIL "base64" 10 NIL'
+            b' ("attachment" ("filename*" "utf-8\'\'my%20r%C3%A9sum%C3%A9.txt")) NIL NIL)'
+        )
+        self.assertEqual(GmailManager._bodystructure_attachments(body)[0]["filename"], "my résumé.txt")
+
+    def test_rfc2231_continuations(self):
+        body = self.parse(
+            b'("application" "octet-stream" ("NAME*0*" "utf-8\'\'r%C3%A9" "NAME*1" "sum\xc3\xa9.txt")'
+            b' NIL NIL "base64" 10 NIL NIL NIL NIL)'
+        )
+        self.assertEqual(GmailManager._bodystructure_attachments(body)[0]["filename"], "résumé.txt")
+
+
+class FakeServer:
+    """
+    A stand-in for an imaplib connection with the inbox selected, recording UID commands.
+    """
+
+    def __init__(self, messages=None, search_results=None, capabilities=("IMAP4REV1", "UIDPLUS")):
+        self.messages = messages or {}
+        self.search_results = search_results or {}
+        self.capabilities = capabilities
+        self.literal = None
+        self.untagged_responses = {}
+        self.calls = []
+
+    def select(self, mailbox):
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, [b"7"]
+
+    def uid(self, command, *args):
+        literal, self.literal = self.literal, None
+        self.calls.append((command, *args) + ((literal,) if literal is not None else ()))
+        if command == "SEARCH":
+            found = self.search_results.get(literal if literal is not None else args[-1])
+            if found is None:
+                return "NO", [b"unsupported"]
+            return "OK", [b" ".join(found)]
+        if command == "FETCH":
+            data = []
+            for uid in args[0].split(b","):
+                raw = self.messages[uid]
+                if "HEADER" in args[1]:
+                    raw = raw.split(b"\r\n\r\n")[0] + b"\r\n\r\n"
+                data += [(b"1 (UID %s RFC822 {%d}" % (uid, len(raw)), raw), b")"]
+            return "OK", data
+        return "OK", [None]
+
+    def commands(self, command):
+        return [call for call in self.calls if call[0] == command]
+
+
+def make_email(server):
+    """
+    Returns an Email whose IMAP connection is server.
+    """
+    with mock.patch.object(GmailManager, "_EMAIL_PASSWORD", "pw"):
+        email = GmailManager.Email("me@example.com", "smtp.example.com")
+    email._get_imap = lambda: server
+    return email
+
+
+def make_message(uid, size=0):
+    return b"Subject: %s\r\nFrom: a@example.com\r\n\r\n%s\r\n" % (uid, b"x" * size)
+
+
+class SearchUidsTest(unittest.TestCase):
+    """
+    Tests for Email._search_uids.
+    """
+
+    def setUp(self):
+        self.server = FakeServer(search_results={
+            '"Invoice"': [b"1", b"2"],
+            "ALL": [b"1", b"2", b"3"],
+            "caf\u00e9".encode(): [b"3", b"1", b"2"],
+            "na\u00efve".encode(): [b"2", b"3"],
+            "\u00fcber".encode(): [],
+        })
+        self.email = make_email(self.server)
+
+    def test_ascii_values_are_quoted(self):
+        self.server.search_results['"a \\"b\\""'] = [b"4"]
+        self.assertEqual(self.email._search_uids(self.server, [("SUBJECT", 'a "b"')]), [b"4"])
+        self.assertEqual(self.server.calls, [("SEARCH", "SUBJECT", '"a \\"b\\""')])
+
+    def test_keys_without_value(self):
+        self.assertEqual(self.email._search_uids(self.server, [("ALL", None)]), [b"1", b"2", b"3"])
+        self.assertEqual(self.server.calls, [("SEARCH", "ALL")])
+
+    def test_non_ascii_value_is_a_utf8_literal_after_charset(self):
+        uids = self.email._search_uids(self.server, [("SUBJECT", "Invoice"), ("BODY", "caf\u00e9")])
+        self.assertEqual(uids, [b"3", b"1", b"2"])
+        self.assertEqual(self.server.calls, [
+            ("SEARCH", "CHARSET", "UTF-8", "SUBJECT", '"Invoice"', "BODY", "caf\u00e9".encode()),
+        ])
+
+    def test_several_non_ascii_values_are_intersected(self):
+        uids = self.email._search_uids(self.server, [("SUBJECT", "caf\u00e9"), ("BODY", "na\u00efve")])
+        self.assertEqual(uids, [b"3", b"2"])
+        self.assertEqual(self.server.calls, [
+            ("SEARCH", "CHARSET", "UTF-8", "SUBJECT", "caf\u00e9".encode()),
+            ("SEARCH", "CHARSET", "UTF-8", "BODY", "na\u00efve".encode()),
+        ])
+
+    def test_empty_intersection_stops_early(self):
+        uids = self.email._search_uids(
+            self.server, [("SUBJECT", "\u00fcber"), ("BODY", "caf\u00e9"), ("TO", "na\u00efve")]
+        )
+        self.assertEqual(uids, [])
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_rejected_search(self):
+        self.assertIsNone(self.email._search_uids(self.server, [("BODY", "unknown")]))
+        self.assertIsNone(self.email._search_uids(self.server, [("BODY", "r\u00e9sum\u00e9")]))
+
+
+class EmailCacheTest(unittest.TestCase):
+    """
+    Tests for the raw email cache behind Email._fetch_email_map.
+    """
+
+    def setUp(self):
+        self.server = FakeServer(messages={uid: make_message(uid) for uid in (b"1", b"2", b"3")})
+        self.email = make_email(self.server)
+        self.email._select("inbox")
+
+    def fetch(self, uids, headers_only=False):
+        return self.email._fetch_email_map(self.server, uids, headers_only)
+
+    def fetched_uids(self):
+        return [call[1] for call in self.server.commands("FETCH")]
+
+    def test_cache_hit_skips_fetch_and_returns_new_objects(self):
+        first = self.fetch([b"1", b"2"])
+        second = self.fetch([b"1", b"2"])
+        self.assertEqual(self.fetched_uids(), [b"1,2"])
+        self.assertIsNot(first[b"1"], second[b"1"])
+        self.assertEqual(second[b"1"]["Subject"], "1")
+        self.assertEqual(self.email.get_email_uid(second[b"1"]), b"1")
+
+    def test_only_missing_uids_are_fetched(self):
+        self.fetch([b"1"])
+        self.fetch([b"1", b"2"])
+        self.assertEqual(self.fetched_uids(), [b"1", b"2"])
+
+    def test_header_only_lookup_uses_full_message(self):
+        self.fetch([b"1"])
+        emails = self.fetch([b"1"], headers_only=True)
+        self.assertEqual(self.fetched_uids(), [b"1"])
+        self.assertEqual(emails[b"1"]["Subject"], "1")
+
+    def test_full_lookup_does_not_use_headers(self):
+        self.fetch([b"1"], headers_only=True)
+        self.fetch([b"1"])
+        self.assertEqual(len(self.fetched_uids()), 2)
+
+    def test_oversized_messages_are_not_cached(self):
+        self.server.messages[b"4"] = make_message(b"4", GmailManager._EMAIL_CACHE_MAX_ENTRY)
+        self.fetch([b"4"])
+        self.fetch([b"4"])
+        self.assertEqual(self.fetched_uids(), [b"4", b"4"])
+        self.assertEqual(self.email._email_cache_bytes, 0)
+
+    def test_least_recently_used_are_evicted_by_size(self):
+        size = len(self.server.messages[b"1"])
+        with mock.patch.object(GmailManager, "_EMAIL_CACHE_BYTES", 2 * size):
+            self.fetch([b"1"])
+            self.fetch([b"2"])
+            self.fetch([b"1"])
+            self.fetch([b"3"])
+        self.assertEqual([key[2] for key in self.email._email_cache], [b"1", b"3"])
+        self.assertEqual(self.email._email_cache_bytes, 2 * size)
+
+    def test_close_empties_cache(self):
+        self.fetch([b"1"])
+        self.email.close()
+        self.assertEqual(len(self.email._email_cache), 0)
+        self.assertEqual(self.email._email_cache_bytes, 0)
+
+
+class DeleteTest(unittest.TestCase):
+    """
+    Tests for Email.delete.
+    """
+
+    def test_refuses_without_uidplus(self):
+        server = FakeServer(capabilities=("IMAP4REV1",))
+        email = make_email(server)
+        with self.assertRaises(GmailManager.imaplib.IMAP4.error):
+            email.delete([b"1"])
+        self.assertEqual(server.calls, [])
+
+    def test_expunges_only_given_uids_and_evicts_them(self):
+        server = FakeServer(messages={uid: make_message(uid) for uid in (b"1", b"2")})
+        email = make_email(server)
+        email._fetch_email_map(email._select("inbox"), [b"1", b"2"])
+        email.delete([b"1"])
+        self.assertEqual(server.calls[1:], [
+            ("STORE", b"1", "+FLAGS", r"(\Deleted)"),
+            ("EXPUNGE", b"1"),
+        ])
+        self.assertEqual([key[2] for key in email._email_cache], [b"2"])
+        self.assertEqual(email._email_cache_bytes, len(server.messages[b"2"]))
+
+
+class GetAttachmentsTest(unittest.TestCase):
+    """
+    Tests for Email.get_attachments.
+    """
+
+    def setUp(self):
+        self.email = make_email(None)
+
+    def parse(self, raw):
+        return GmailManager._PARSER.parsebytes(raw)
+
+    def filenames(self, raw):
+        return [part.get_filename() for part in self.email.get_attachments(self.parse(raw))]
+
+    def test_mixed(self):
+        raw = (
+            b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+            b'--b\r\nContent-Type: text/plain\r\n\r\nhello\r\n'
+            b'--b\r\nContent-Type: application/pdf\r\n'
+            b'Content-Disposition: attachment; filename="a.pdf"\r\n\r\nx\r\n'
+            b'--b--\r\n'
+        )
+        self.assertEqual(self.filenames(raw), ["a.pdf"])
+
+    def test_single_part(self):
+        raw = (
+            b'Content-Type: application/pdf\r\n'
+            b'Content-Disposition: attachment; filename="a.pdf"\r\n\r\nx\r\n'
+        )
+        self.assertEqual(self.filenames(raw), ["a.pdf"])
+
+    def test_single_part_without_disposition(self):
+        self.assertEqual(self.filenames(b'Content-Type: text/plain\r\n\r\nhello\r\n'), [])
+
+    def test_alternative(self):
+        raw = (
+            b'Content-Type: multipart/alternative; boundary="b"\r\n\r\n'
+            b'--b\r\nContent-Type: text/plain\r\n\r\nhello\r\n'
+            b'--b\r\nContent-Type: application/pdf\r\n'
+            b'Content-Disposition: attachment; filename="a.pdf"\r\n\r\nx\r\n'
+            b'--b--\r\n'
+        )
+        self.assertEqual(self.filenames(raw), ["a.pdf"])
+
+    def test_nested_multipart(self):
+        raw = (
+            b'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+            b'--b\r\nContent-Type: text/plain\r\n\r\nhello\r\n'
+            b'--b\r\nContent-Type: multipart/mixed; boundary="c"\r\n\r\n'
+            b'--c\r\nContent-Type: image/png\r\n'
+            b'Content-Disposition: inline; filename="b.png"\r\n\r\nx\r\n'
+            b'--c\r\nContent-Type: text/plain\r\n'
+            b'Content-Disposition: attachment; filename="c.txt"\r\n\r\ny\r\n'
+            b'--c--\r\n'
+            b'--b--\r\n'
+        )
+        self.assertEqual(self.filenames(raw), ["b.png", "c.txt"])
+
+
+class GatherEmailsTest(unittest.TestCase):
+    """
+    Tests for Email.gather_emails.
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(GmailManager, "_EMAIL_PASSWORD", "pw")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def query(self, worker, subject):
+        self.record(("start", subject))
+        if subject == "bad":
+            raise ValueError(subject)
+        time.sleep(0.1)
+        self.record(("end", subject))
+        return [subject]
+
+    def gather(self, queries, max_connections=2):
+        email = GmailManager.Email("me@example.com", "smtp.example.com")
+        test = self
+        with mock.patch.object(GmailManager.Email, "get_emails_by_subject", lambda worker, subject: test.query(worker, subject)), \
+                mock.patch.object(GmailManager.Email, "close", lambda worker: test.record(("close",))):
+            return asyncio.run(email.gather_emails(queries, max_connections))
+
+    def test_results_in_query_order(self):
+        queries = [("get_emails_by_subject", subject) for subject in ("a", "b", "c")]
+        self.assertEqual(self.gather(queries), [["a"], ["b"], ["c"]])
+
+    def test_failure_waits_for_running_queries(self):
+        queries = [("get_emails_by_subject", subject) for subject in ("bad", "slow", "queued")]
+        with self.assertRaises(ValueError):
+            self.gather(queries)
+        # The worker running "slow" is closed only after it finished, and the
+        # query queued behind the failure never starts.
+        self.assertLess(self.events.index(("end", "slow")), self.events.index(("close",)))
+        self.assertNotIn(("start", "queued"), self.events)
+
+    def test_cancellation_waits_for_running_queries(self):
+        email = GmailManager.Email("me@example.com", "smtp.example.com")
+        test = self
+
+        async def cancel_while_running():
+            task = asyncio.ensure_future(email.gather_emails(
+                [("get_emails_by_subject", subject) for subject in ("slow", "slower", "queued")]
+            ))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(GmailManager.Email, "get_emails_by_subject", lambda worker, subject: test.query(worker, subject)), \
+                mock.patch.object(GmailManager.Email, "close", lambda worker: test.record(("close",))):
+            asyncio.run(cancel_while_running())
+        self.assertEqual(self.events[-1], ("close",))
+        self.assertNotIn(("start", "queued"), self.events)
+
+    def test_no_queries(self):
+        self.assertEqual(self.gather([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()